@@ -4,7 +4,6 @@ import os
 import datetime
 import subprocess
 import random
-import tempfile
 import hashlib
 
 import email
@@ -18,18 +17,54 @@ import mimetypes
 #   Email Utilities
 # ---------------------------------------
 class EmailUtils:
+    # Shared stylesheet for bordered tables in HTML reports/notifications
+    TABLE_CSS = """\
+        table, th, td {
+            border: 1px solid;
+            border-collapse: collapse;
+        }
+        th, td {
+            padding-top: 3px; padding-bottom: 3px;
+            padding-left: 5px; padding-right: 5px;
+        }
+    """
+
     @staticmethod
     def _send_msg(msg):
-        with tempfile.NamedTemporaryFile(suffix='.eml', delete=False) as eml_f:
-            eml_f.write(msg.as_bytes())
-            eml_f.flush()
-            subprocess.check_call(f'sendmail -t < {eml_f.name}', shell=True)
+        subprocess.run(['sendmail', '-t'], input=msg.as_bytes(), check=True)
 
     @staticmethod
     def _gen_msg_id():
         dt = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         return f'<{dt}.{"%016x" % random.randrange(16 ** 16)}@hauto-offload.local>'
 
+    @staticmethod
+    def _new_msg(email_addr, subject):
+        msg = MIMEMultipart()
+        msg['To'] = email_addr
+        msg['From'] = f'Automation Bot <{email_addr}>'
+        msg['In-Reply-To'] = msg['From']
+        msg['Subject'] = subject
+        msg['Message-Id'] = EmailUtils._gen_msg_id()
+        return msg
+
+    @staticmethod
+    def _make_inline_part(cid, img_fname):
+        with open(img_fname, 'rb') as fd:
+            mimetype, mimeencoding = mimetypes.guess_type(img_fname)
+            if mimeencoding or (mimetype is None):
+                mimetype = 'application/octet-stream'
+            maintype, subtype = mimetype.split('/')
+            if maintype == 'text':
+                part = MIMEText(fd.read(), _subtype=subtype)
+            else:
+                part = MIMEBase(maintype, subtype)
+                part.set_payload(fd.read())
+                email.encoders.encode_base64(part)
+        part.add_header('Content-ID', f'<{cid}>')
+        part.add_header('Content-Disposition', 'inline', filename=img_fname)
+        return part
+
     @staticmethod
     def unique_footer():
         rand_md5 = hashlib.md5(datetime.datetime.utcnow().isoformat().encode()).hexdigest()
@@ -39,12 +74,7 @@ class EmailUtils:
 
     @staticmethod
     def send_email_text(email_addr, subject, body, uniquify = True):
-        msg = MIMEMultipart()
-        msg['To'] = email_addr
-        msg['From'] = f'Automation Bot <{email_addr}>'
-        msg['In-Reply-To'] = msg['From']
-        msg['Subject'] = subject
-        msg['Message-Id'] = EmailUtils._gen_msg_id()
+        msg = EmailUtils._new_msg(email_addr, subject)
         if uniquify:
             body += EmailUtils.unique_footer()
         body = MIMEText(f'<html><body>{body}</body></html>', _subtype='html')
@@ -53,56 +83,20 @@ class EmailUtils:
 
     @staticmethod
     def send_email_image(email_addr, subject, img_fname):
-        msg = MIMEMultipart()
-        msg['To'] = email_addr
-        msg['From'] = f'Automation Bot <{email_addr}>'
-        msg['In-Reply-To'] = msg['From']
-        msg['Subject'] = subject
-        msg['Message-Id'] = EmailUtils._gen_msg_id()
+        msg = EmailUtils._new_msg(email_addr, subject)
         message = '<html><body><img src="cid:img_payload"/></body></html>'
         body = MIMEText(message, _subtype='html')
         msg.attach(body)
-        with open(img_fname, 'rb') as fd:
-            mimetype, mimeencoding = mimetypes.guess_type(img_fname)
-            if mimeencoding or (mimetype is None):
-                mimetype = 'application/octet-stream'
-            maintype, subtype = mimetype.split('/')
-            if maintype == 'text':
-                attachment = MIMEText(fd.read(), _subtype=subtype)
-            else:
-                attachment = MIMEBase(maintype, subtype)
-                attachment.set_payload(fd.read())
-                email.encoders.encode_base64(attachment)
-            attachment.add_header('Content-ID', '<img_payload>')
-            attachment.add_header('Content-Disposition', 'inline', filename=img_fname)
-        msg.attach(attachment)
+        msg.attach(EmailUtils._make_inline_part('img_payload', img_fname))
         EmailUtils._send_msg(msg)
 
     @staticmethod
     def send_email_html(email_addr, subject, body_html, inline_images = {}, attachments = []):
-        msg = MIMEMultipart()
-        msg['To'] = email_addr
-        msg['From'] = f'Automation Bot <{email_addr}>'
-        msg['In-Reply-To'] = msg['From']
-        msg['Subject'] = subject
-        msg['Message-Id'] = EmailUtils._gen_msg_id()
+        msg = EmailUtils._new_msg(email_addr, subject)
         body = MIMEText(body_html, _subtype='html')
         msg.attach(body)
         for cid, img_fname in inline_images.items():
-            with open(img_fname, 'rb') as fd:
-                mimetype, mimeencoding = mimetypes.guess_type(img_fname)
-                if mimeencoding or (mimetype is None):
-                    mimetype = 'application/octet-stream'
-                maintype, subtype = mimetype.split('/')
-                if maintype == 'text':
-                    attachment = MIMEText(fd.read(), _subtype=subtype)
-                else:
-                    attachment = MIMEBase(maintype, subtype)
-                    attachment.set_payload(fd.read())
-                    email.encoders.encode_base64(attachment)
-                attachment.add_header('Content-ID', f'<{cid}>')
-                attachment.add_header('Content-Disposition', 'inline', filename=img_fname)
-            msg.attach(attachment)
+            msg.attach(EmailUtils._make_inline_part(cid, img_fname))
         for att_fname in attachments:
             with open(att_fname, 'rb') as fd:
                 part = MIMEApplication(fd.read(), Name=os.path.basename(att_fname))
@@ -114,20 +108,23 @@ class EmailUtils:
 #   MAC Address Lookup
 # ---------------------------------------
 class MacAddrDb:
+    # (table, csv file, prefix length in hex digits), in lookup order
+    TABLES = (('MA-L', 'oui.csv', 6), ('MA-M', 'mam.csv', 7), ('MA-S', 'oui36.csv', 8))
+
     def __init__(self, table_dir):
-        FILE_MAP = {'MA-L':'oui.csv', 'MA-M':'mam.csv', 'MA-S':'oui36.csv'}
-        self.mac_tbls = {}
-        for tbl, fname in FILE_MAP.items():
-            self.mac_tbls[tbl] = {}
+        self.mac_tbls = []
+        for tbl, fname, prefix_len in MacAddrDb.TABLES:
+            vendors = {}
             with open(os.path.join(table_dir, fname)) as tbl_f:
-                for csv_l in tbl_f.readlines():
+                for csv_l in tbl_f:
                     toks = [x.strip() for x in csv_l.split(',')]
-                    self.mac_tbls[tbl][toks[1].upper()] = toks[2]
+                    vendors[toks[1].upper()] = toks[2].strip('"')
+            self.mac_tbls.append((prefix_len, vendors))
 
     def get_vendor(self, mac_addr, default = None):
-        LOOKUPS = {'MA-L':6, 'MA-M':7, 'MA-S':8}
         mac_clean = mac_addr.replace(':','').upper()
-        for tbl, prefix_len in LOOKUPS.items():
-            if mac_clean[:prefix_len] in self.mac_tbls[tbl]:
-                return self.mac_tbls[tbl][mac_clean[:prefix_len]].strip('"')
+        for prefix_len, vendors in self.mac_tbls:
+            vendor = vendors.get(mac_clean[:prefix_len])
+            if vendor is not None:
+                return vendor
         return default
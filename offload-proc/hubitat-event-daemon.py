@@ -1,124 +1,129 @@
 #!/usr/bin/env python3
 import subprocess
+import signal
 import time
 import logging
 import json
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import random
+from concurrent.futures import ThreadPoolExecutor
 from lanmon import LanMonitor
 
 class Worker:
     def __init__(self, dev, hub_xact_fn):
         self.dev = dev
-        self._hub_xact_fn = hub_xact_fn
-        start_offs = random.randrange(0, self.dev['poll-interval'])
-        self._next_run_time = time.time() + start_offs
+        self.hub_transact = hub_xact_fn
+        self.poll_interval = dev['poll-interval']
+        self._work_tag = f'{dev["name"]}: {dev["worker"]}::work()'
+        start_offs = random.randrange(0, self.poll_interval)
+        self.next_run_time = time.monotonic() + start_offs
+        self.is_online = None
+        self._debounce_time = dev.get('debounce-time', 0.0)
+        self._pending_online = None
+        self._pending_since = 0.0
 
     def work_if_due(self):
-        time_now = time.time()
-        if time_now > self._next_run_time:
+        time_now = time.monotonic()
+        if time_now > self.next_run_time:
             self.work()
-            self._next_run_time = time_now + self.dev['poll-interval']
-            logging.debug(f'{self.dev["name"]}: {self.dev["worker"]}::work() '
-                          f'finished in {(time.time()-time_now):03f}s')
-    def hub_transact(self, *args, **kwargs):
-        return self._hub_xact_fn(*args, **kwargs)
+            self.next_run_time = time_now + self.poll_interval
+            logging.debug('%s finished in %03fs', self._work_tag, time.monotonic() - time_now)
+
+    def report_online(self, curr_online):
+        # Defer debounce: commit a new status only after it has been stable for debounce-time
+        time_now = time.monotonic()
+        if curr_online != self._pending_online:
+            self._pending_online = curr_online
+            self._pending_since = time_now
+        if self.is_online != curr_online and (time_now - self._pending_since) >= self._debounce_time:
+            self.is_online = curr_online
+            self.hub_transact('dev_cmd', on_error=self._report_failed, dev_id=self.dev['id'],
+                cmd=('arrived' if curr_online else 'departed'))
+            logging.info(f'{self.dev["name"]}: Online status changed to {curr_online}')
 
-class Pinger(Worker):
-    def __init__(self, dev, hub_xact_fn, _):
-        super(Pinger, self).__init__(dev, hub_xact_fn)
-        self.ip_addr = dev['worker-args']['addr']
+    def _report_failed(self):
+        # The hub never got the update. Forget the committed status so the next poll resends it.
         self.is_online = None
-        self.ping_proc = None
+
+class ProcWorker(Worker):
+    # Base for workers that run a command in the background and check its result on later polls
+    def __init__(self, dev, hub_xact_fn, cmd, capture_output = False):
+        super(ProcWorker, self).__init__(dev, hub_xact_fn)
+        self.cmd = cmd
+        # Only pipe stdout if proc_done() looks at it
+        self.cmd_stdout = subprocess.PIPE if capture_output else subprocess.DEVNULL
+        self.proc = None
 
     def work(self):
-        dispatch_ping = False
-        if self.ping_proc is not None:
-            if self.ping_proc.poll() is not None:
-                self.ping_proc.communicate()
-                dispatch_ping = True
-                curr_online = (self.ping_proc.returncode == 0)
-                if self.is_online != curr_online:
-                    self.hub_transact('dev_cmd', dev_id=self.dev['id'],
-                        cmd=('arrived' if curr_online else 'departed'))
-                    logging.info(f'{self.dev["name"]}: Online status changed to {curr_online}')
-                self.is_online = curr_online
-        else:
-            dispatch_ping = True
-        if dispatch_ping:
-            self.ping_proc = subprocess.Popen(['ping', self.ip_addr, '-i', '0.5', '-c', '5'],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-class InternetChecker(Worker):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                return
+            pout = self.proc.communicate()[0]
+            self.proc_done(self.proc.returncode, pout)
+        self.proc = subprocess.Popen(self.cmd,
+            stdout=self.cmd_stdout, stderr=subprocess.DEVNULL)
+
+    def proc_done(self, returncode, pout):
+        raise NotImplementedError()
+
+class Pinger(ProcWorker):
     def __init__(self, dev, hub_xact_fn, _):
-        super(InternetChecker, self).__init__(dev, hub_xact_fn)
-        self.is_online = None
-        self.curl_proc = None
+        self.ip_addr = dev['worker-args']['addr']
+        super(Pinger, self).__init__(dev, hub_xact_fn,
+            ['ping', self.ip_addr, '-i', '0.5', '-c', '5'])
 
-    def work(self):
-        dispatch_curl = False
-        if self.curl_proc is not None:
-            if self.curl_proc.poll() is not None:
-                pout = self.curl_proc.communicate()[0].decode('utf-8')
-                dispatch_curl = True
-                curr_online = (self.curl_proc.returncode == 0 and 'OK' in pout.split('\n')[0])
-                if self.is_online != curr_online:
-                    self.hub_transact('dev_cmd', dev_id=self.dev['id'],
-                        cmd=('arrived' if curr_online else 'departed'))
-                    logging.info(f'{self.dev["name"]}: Online status changed to {curr_online}')
-                self.is_online = curr_online
-        else:
-            dispatch_curl = True
-        if dispatch_curl:
-            self.curl_proc = subprocess.Popen(['curl', '-m', '5', '-I', 'http://www.example.com'],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-class MotionPoll(Worker):
+    def proc_done(self, returncode, pout):
+        self.report_online(returncode == 0)
+
+class InternetChecker(ProcWorker):
     def __init__(self, dev, hub_xact_fn, _):
-        super(MotionPoll, self).__init__(dev, hub_xact_fn)
-        self.curl_proc = None
+        super(InternetChecker, self).__init__(dev, hub_xact_fn,
+            ['curl', '-m', '5', '-I', 'http://www.example.com'], capture_output=True)
 
-    def work(self):
-        dispatch_poll = False
-        if self.curl_proc is not None:
-            if self.curl_proc.poll() is not None:
-                self.curl_proc.communicate()
-                dispatch_poll = True
-                if self.curl_proc.returncode > 0:
-                    self.hub_transact('dev_cmd', dev_id=self.dev['id'], cmd='active')
-                    logging.info(f'{self.dev["name"]}: Motion detected')
-        else:
-            dispatch_poll = True
-        if dispatch_poll:
-            self.curl_proc = subprocess.Popen(['python3', '/usr/local/bin/motion-poll.py',
-                '-d', self.dev['worker-args']['dir'], '-e', self.dev['worker-args']['email'],
-                '-n', self.dev["name"]],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def proc_done(self, returncode, pout):
+        # Only the status line matters. Scan it as bytes without decoding the headers.
+        self.report_online(returncode == 0 and b'OK' in pout.partition(b'\n')[0])
+
+class MotionPoll(ProcWorker):
+    def __init__(self, dev, hub_xact_fn, _):
+        super(MotionPoll, self).__init__(dev, hub_xact_fn,
+            ['python3', '/usr/local/bin/motion-poll.py',
+             '-d', dev['worker-args']['dir'], '-e', dev['worker-args']['email'],
+             '-n', dev["name"]])
+
+    def proc_done(self, returncode, pout):
+        if returncode > 0:
+            self.hub_transact('dev_cmd', dev_id=self.dev['id'], cmd='active')
+            logging.info(f'{self.dev["name"]}: Motion detected')
 
 class LanMonReader(Worker):
     def __init__(self, dev, hub_xact_fn, ifaces):
         super(LanMonReader, self).__init__(dev, hub_xact_fn)
         self.lanmon = ifaces['lan-monitor']
         self.ip_addr = dev['worker-args']['addr']
-        self.is_online = None
 
     def work(self):
-        curr_online = False
-        for ip, _, _, _ in self.lanmon.get_active_clients():
-            if ip == self.ip_addr:
-                curr_online = True
-                break
-        if self.is_online != curr_online:
-            self.hub_transact('dev_cmd', dev_id=self.dev['id'],
-                cmd=('arrived' if curr_online else 'departed'))
-            logging.info(f'{self.dev["name"]}: Online status changed to {curr_online}')
-        self.is_online = curr_online
+        self.report_online(self.lanmon.is_client_active(self.ip_addr))
+
+WORKER_TYPES = {cls.__name__: cls for cls in (Pinger, InternetChecker, MotionPoll, LanMonReader)}
 
 class EventDaemon:
+    HUB_TIMEOUT_S = 10.0
     def __init__(self, cfg_file, poll_interval):
         CFG_FILE_VER = 1
         self.poll_interval = poll_interval
+        # All Maker API calls go to the same hub. Keep the connection alive between polls.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4,
+            max_retries=Retry(total=2, backoff_factor=0.2))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+        # Device commands are sent off the poll loop. One thread keeps them in order.
+        self.notify_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hub-notify')
         with open(cfg_file) as json_f:
             cfg_blob = json.load(json_f)
             if cfg_blob['version'] != CFG_FILE_VER:
@@ -129,7 +134,7 @@ class EventDaemon:
                 'ls_dev': lambda: f'{url_prefix}all{url_suffix}',
                 'dev_info': lambda dev_id: f'{url_prefix}{dev_id}{url_suffix}',
                 'dev_cmd': lambda dev_id, cmd: f'{url_prefix}{dev_id}/{cmd}{url_suffix}',
-                'dev_cmd_arg': lambda dev_id, cmd, arg: f'{url_prefix}{dev_id}/{cmd}/{val}{url_suffix}',
+                'dev_cmd_arg': lambda dev_id, cmd, arg: f'{url_prefix}{dev_id}/{cmd}/{arg}{url_suffix}',
             }
             self.avail_devs = {}
             for dev in self.hub_transact('ls_dev'):
@@ -144,24 +149,52 @@ class EventDaemon:
                     raise RuntimeError(f'Could not access device through Maker API')
                 if dev["poll-interval"] < poll_interval:
                     raise RuntimeError(f'Poll interval of device is less than that of the daemon')
-                self.workers[dev_id] = globals()[dev['worker']](dev, self.hub_transact, self.worker_ifaces)
+                if dev['worker'] not in WORKER_TYPES:
+                    raise RuntimeError(f'Unknown worker type {dev["worker"]}')
+                self.workers[dev_id] = WORKER_TYPES[dev['worker']](dev, self.hub_notify, self.worker_ifaces)
 
-    def hub_transact(self, op, **kwargs):
+    def _hub_request(self, op, kwargs):
         url = self.url_fns[op](**kwargs)
-        response = requests.get(url)
-        return response.json()
+        response = self.session.get(url, timeout=EventDaemon.HUB_TIMEOUT_S)
+        response.raise_for_status()
+        return response
+
+    def hub_transact(self, op, **kwargs):
+        return self._hub_request(op, kwargs).json()
+
+    def hub_notify(self, op, on_error = None, **kwargs):
+        # Fire-and-forget commands. Nobody reads the response so don't parse it.
+        future = self.notify_pool.submit(self._hub_request, op, kwargs)
+        future.add_done_callback(lambda f: EventDaemon._handle_notify_error(f, on_error))
+
+    @staticmethod
+    def _handle_notify_error(future, on_error):
+        if future.exception() is not None:
+            logging.error(f'Hub transaction failed: {future.exception()}')
+            if on_error is not None:
+                on_error()
 
     def run(self):
-        while True:
-            try:
-                for dev_id, worker in self.workers.items():
-                    worker.work_if_due()
-                time.sleep(self.poll_interval)
-            except KeyboardInterrupt:
-                logging.info('Stopping event loop...')
-                self.worker_ifaces['lan-monitor'].stop()
-                logging.info('Event loop terminated')
-                return
+        # Handle SIGTERM like Ctrl-C. Raising from the handler interrupts the sleep below and
+        # avoids touching any locks from signal context.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        workers = tuple(self.workers.values())
+        work_fns = tuple(w.work_if_due for w in workers)
+        try:
+            while True:
+                for work_if_due in work_fns:
+                    work_if_due()
+                # Sleep until the next worker is due instead of a full poll interval
+                next_due = min((w.next_run_time for w in workers),
+                               default=time.monotonic() + self.poll_interval)
+                time.sleep(min(max(next_due - time.monotonic(), 0.0), self.poll_interval))
+        except KeyboardInterrupt:
+            pass
+        logging.info('Stopping event loop...')
+        self.worker_ifaces['lan-monitor'].stop()
+        # Drop commands still queued rather than sending them one by one on the way out
+        self.notify_pool.shutdown(wait=True, cancel_futures=True)
+        logging.info('Event loop terminated')
 
 def main():
     parser = argparse.ArgumentParser(description='Hubitat Event Notifier Daemon')
@@ -171,6 +204,10 @@ def main():
     args = parser.parse_args()
 
     log_level = logging.DEBUG if args.verbose else logging.INFO
+    # The log format doesn't use thread/process info so skip collecting it per record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     logging.basicConfig(level=log_level)
 
     evnt_dmn = EventDaemon(args.cfg_json, args.poll_interval)
@@ -12,9 +12,7 @@ import pickle
 from waitress import serve
 from werkzeug.wrappers import Request, Response
 from jsonrpc import JSONRPCResponseManager, dispatcher
-from webshot_ffox import WebScreenshotFirefox
 from common import EmailUtils
-from reportgen import HistoryReportGen, NetworkReportGen
 
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -24,6 +22,9 @@ CFG_DIR = os.path.join(HOME_DIR, 'cfg')
 CACHE_DIR = os.path.join(HOME_DIR, 'cache')
 RPC_PORT = 4226
 
+# Shared by all local REST helpers so connections are reused across RPCs
+HTTP_SESSION = requests.Session()
+
 def get_host_ip_addr(wait_for_network = True, timeout = 30):
     cmd = "hostname -i | awk '{print $1}'"
     get_ip = lambda: subprocess.check_output(cmd, shell=True).strip().decode('utf-8')
@@ -52,6 +53,7 @@ def rpc_email_web_snapshot(email_addr, subject, page_url, load_delay):
         f'page_url={page_url}, load_delay={load_delay})')
     # Open headless firefox and resize window
     logging.info('rpc_email_web_snapshot: Starting browser...')
+    from webshot_ffox import WebScreenshotFirefox
     webshot = WebScreenshotFirefox()
     # Load URL and save screenshot
     logging.info('rpc_email_web_snapshot: Loading page and saving screenshot...')
@@ -67,6 +69,7 @@ def rpc_email_history_report(email_addr, duration_hr):
     logging.info(f'rpc_email_history_report(email_addr={email_addr}, duration_hr={duration_hr})')
     t_stop = datetime.datetime.now()
     t_strt = t_stop - datetime.timedelta(hours=duration_hr)
+    from reportgen import HistoryReportGen
     rgen = HistoryReportGen(os.path.join(CFG_DIR, 'history-report.json'),
         os.path.join(CFG_DIR, 'influxdb.cred'))
     rgen.send_email(t_strt, t_stop, email_addr)
@@ -75,6 +78,7 @@ def rpc_email_network_report(email_addr, verbosity):
     logging.info(f'rpc_email_network_report()')
     with open(os.path.join(CACHE_DIR, 'lanmon_clients.pickle'), 'rb') as handle:
         lanmon_blob = pickle.load(handle)
+    from reportgen import NetworkReportGen
     rgen = NetworkReportGen(lanmon_blob['clients'], verbosity)
     rgen.send_email(email_addr)
 
@@ -84,10 +88,41 @@ def rpc_email_network_report(email_addr, verbosity):
 class RoombaUtils:
     STATE_URL = 'http://localhost:8200/api/local/info/state'
     ACTION_URL_BASE = 'http://localhost:8200/api/local/action/'
+    ALL_ACTIONS = ['start', 'stop', 'pause', 'resume', 'dock', 'reset', 'locate']
+    READY_MSGS = {
+        0  : 'Okay',
+        2  : 'Uneven Ground',
+        7  : 'Bin Detached',
+        15 : 'Low Battery',
+        16 : 'Bin Full',
+        39 : 'Pending',
+        48 : 'Path Blocked',
+    }
+    ERROR_MSGS = {
+        0  : 'Okay',
+        15 : 'Reboot Required',
+        18 : 'Docking Issue',
+    }
+    PHASES = {
+        'charge'    : 'Charging',
+        'run'       : 'Running',
+        'evac'      : 'Empty',
+        'stop'      : 'Paused',
+        'stuck'     : 'Stuck',
+        'hmUsrDock' : 'Sent Home',
+        'hmMidMsn'  : 'Mid Dock',
+        'hmPostMsn' : 'Final Dock'
+    }
+    BIN_STATUS = {
+        (False, False)  : 'Bin Detached',
+        (False, True)   : 'Bin Detached',
+        (True, False)   : 'Bin Not Full',
+        (True, True)    : 'Bin Full',
+    }
 
     @staticmethod
     def get_full_state():
-        response = requests.get(RoombaUtils.STATE_URL)
+        response = HTTP_SESSION.get(RoombaUtils.STATE_URL)
         return response.json()
 
     @staticmethod
@@ -104,59 +139,30 @@ class RoombaUtils:
             'last_cmd': reported['lastCommand']['command'],
             'last_cmd_time': reported['lastCommand']['time'],
         }
-        try:
-            pretty_state['ready_msg'] = 'Ready: ' + {
-                0  : 'Okay',
-                2  : 'Uneven Ground',
-                7  : 'Bin Detached',
-                15 : 'Low Battery',
-                16 : 'Bin Full',
-                39 : 'Pending',
-                48 : 'Path Blocked',
-            }[reported['cleanMissionStatus']['notReady']]
-        except KeyError:
-            pretty_state['ready_msg'] = f"Ready: Unknown{reported['cleanMissionStatus']['notReady']}"
-        try:
-            pretty_state['error_msg'] = 'Status: ' + {
-                0  : 'Okay',
-                15 : 'Reboot Required',
-                18 : 'Docking Issue',
-            }[reported['cleanMissionStatus']['error']]
-        except KeyError:
-            pretty_state['error_msg'] = f"Status: Unknown{reported['cleanMissionStatus']['error']}"
-        if reported['cleanMissionStatus']['phase'] == 'charge' and reported['batPct'] == 100:
+        mission = reported['cleanMissionStatus']
+        not_ready = mission['notReady']
+        pretty_state['ready_msg'] = 'Ready: ' + \
+            RoombaUtils.READY_MSGS.get(not_ready, f'Unknown{not_ready}')
+        error = mission['error']
+        pretty_state['error_msg'] = 'Status: ' + \
+            RoombaUtils.ERROR_MSGS.get(error, f'Unknown{error}')
+        phase = mission['phase']
+        if phase == 'charge' and reported['batPct'] == 100:
             pretty_state['phase'] = 'Roomba Idle'
-        elif reported['cleanMissionStatus']['cycle'] == 'none' and reported['cleanMissionStatus']['phase'] == 'stop':
+        elif mission['cycle'] == 'none' and phase == 'stop':
             pretty_state['phase'] = 'Roomba Stopped'
         else:
-            try:
-                pretty_state['phase'] = 'Roomba ' + {
-                    'charge'    : 'Charging',
-                    'run'       : 'Running',
-                    'evac'      : 'Empty',
-                    'stop'      : 'Paused',
-                    'stuck'     : 'Stuck',
-                    'hmUsrDock' : 'Sent Home',
-                    'hmMidMsn'  : 'Mid Dock',
-                    'hmPostMsn' : 'Final Dock' 
-                }[reported['cleanMissionStatus']['phase']]
-            except KeyError:
-                pretty_state['phase'] = 'Roomba ' + reported['cleanMissionStatus']['phase']
-        pretty_state['bin_status'] = {
-            (False, False)  : 'Bin Detached',
-            (False, True)   : 'Bin Detached',
-            (True, False)   : 'Bin Not Full',
-            (True, True)    : 'Bin Full',
-        }[(reported['bin']['present'], reported['bin']['full'])]
+            pretty_state['phase'] = 'Roomba ' + RoombaUtils.PHASES.get(phase, phase)
+        pretty_state['bin_status'] = \
+            RoombaUtils.BIN_STATUS[(reported['bin']['present'], reported['bin']['full'])]
         return pretty_state
 
     @staticmethod
     def send_cmd(action):
-        ALL_ACTIONS = ['start', 'stop', 'pause', 'resume', 'dock', 'reset', 'locate']
-        if action in ALL_ACTIONS:
-            response = requests.get(RoombaUtils.ACTION_URL_BASE + action)
+        if action in RoombaUtils.ALL_ACTIONS:
+            response = HTTP_SESSION.get(RoombaUtils.ACTION_URL_BASE + action)
         else:
-            raise ValueError(f'Invalid action={action}. Must be {" ".join(ALL_ACTIONS)}')
+            raise ValueError(f'Invalid action={action}. Must be {" ".join(RoombaUtils.ALL_ACTIONS)}')
 
 def rpc_roomba_get_state(what):
     logging.info(f'rpc_roomba_get_state(what={what})')
@@ -176,16 +182,16 @@ def rpc_roomba_send_cmd(action):
 # ---------------------------------------
 class MotionUtils:
     BASE_URL = 'http://localhost:3724'
+    CMD_MAP = {
+        'restart': 'action/end',
+        'eventstart': 'action/eventstart',
+        'eventend': 'action/eventend',
+        'status': 'detection/connection'
+    }
 
     @staticmethod
     def send_cmd(cam_id, cmd):
-        CMD_MAP = {
-            'restart': 'action/end',
-            'eventstart': 'action/eventstart',
-            'eventend': 'action/eventend',
-            'status': 'detection/connection'
-        }
-        response = requests.get(f'{MotionUtils.BASE_URL}/{cam_id}/{CMD_MAP[cmd]}')
+        response = HTTP_SESSION.get(f'{MotionUtils.BASE_URL}/{cam_id}/{MotionUtils.CMD_MAP[cmd]}')
         return [response.text]
 
 def rpc_motion_send_cmd(cam_id, cmd):
@@ -208,11 +214,15 @@ def rpc_check_health():
     logging.info(f'rpc_check_health()')
     fail_cnt = 0
     health = {}
-    for svc in ['hubitat-offload', 'hubitat-event', 'roomba-svr']:
-        try:
-            subprocess.check_output(f'systemctl status {svc}', shell=True, stderr=subprocess.STDOUT)
+    services = ['hubitat-offload', 'hubitat-event', 'roomba-svr']
+    # One systemctl call for all services. It prints one state per unit, in order.
+    proc = subprocess.run(['systemctl', 'is-active', *services],
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    states = proc.stdout.decode('utf-8').split()
+    for idx, svc in enumerate(services):
+        if idx < len(states) and states[idx] == 'active':
             health[svc] = 'OKAY'
-        except subprocess.CalledProcessError:
+        else:
             fail_cnt += 1
             health[svc] = 'FAILED'
     health['overall'] = 'DEGRADED' if fail_cnt else 'OKAY'
@@ -230,10 +240,10 @@ def hub_authenticate(cookie):
     try:
         resp_rem = subprocess.check_output(
             f'echo "{cookie}" | openssl enc -d -des3 -base64 -pass pass:{shared_sec} -pbkdf2',
-            shell=True).strip().decode('utf-8')
-        resp_lcl = subprocess.check_output('cat /sys/class/net/eth0/address',
-            shell=True).strip().decode('utf-8')
-    except:
+            shell=True, stderr=subprocess.DEVNULL).strip().decode('utf-8')
+        with open('/sys/class/net/eth0/address', 'r') as mac_f:
+            resp_lcl = mac_f.read().strip()
+    except (subprocess.CalledProcessError, UnicodeDecodeError, OSError):
         raise PermissionError('Secret validation failed. Permission denied.')
     if resp_rem != resp_lcl:
         raise PermissionError('Secret validation failed. Permission denied.')
@@ -257,8 +267,8 @@ def rpc_hub_safe_shutdown(cookie):
     hub_authenticate(cookie)
     logging.info('rpc_hub_safe_shutdown: Permission granted. Shutting down hub and system...')
     os.system(f'bash {os.path.join(SCRIPT_DIR, "hubitat-admin-ctrl.sh")} shutdown')
-    time.sleep(10.0)
-    subprocess.Popen(['sleep 3; sudo /sbin/shutdown -h now'], shell=True) # Nonblocking
+    # Give the hub time to shut down without holding an RPC worker thread
+    subprocess.Popen(['sleep 13; sudo /sbin/shutdown -h now'], shell=True) # Nonblocking
     return cookie
 
 SWA_CHECKIN_SCRIPT = '/home/admin/src/third-party/swa-checkin/southwest.py'
@@ -273,12 +283,14 @@ def rpc_swa_checkin_schedule(confirmation_arg, fname_arg, lname_arg):
         with open(os.path.join(CACHE_DIR, 'swa-checkin-cache.csv'), 'r') as csv_f:
             checkins = [tuple(l.strip().split(',')) for l in csv_f.readlines()]
 
-    delay = 0
-    for confirmation, fname, lname in checkins:
-        cmd = f'ssh {SWA_CHECKIN_TARGET} "sleep {delay}; python3 {SWA_CHECKIN_SCRIPT} {confirmation} {fname} {lname} &"'
+    # Schedule all checkins (staggered by 20s) over a single ssh session
+    remote_cmds = []
+    for idx, (confirmation, fname, lname) in enumerate(checkins):
+        remote_cmds.append(f'(sleep {idx * 20}; python3 {SWA_CHECKIN_SCRIPT} {confirmation} {fname} {lname}) &')
+    if remote_cmds:
+        cmd = f'ssh {SWA_CHECKIN_TARGET} "{" ".join(remote_cmds)}"'
         subprocess.Popen([cmd], shell=True) # Nonblocking
         logging.info(f'rpc_swa_checkin: Dispatched {cmd}')
-        delay += 20
 
 def rpc_swa_checkin_ls(email_addr):
     logging.info(f'rpc_swa_checkin_ls()')
@@ -311,41 +323,47 @@ def rpc_swa_checkin_killall():
 #   Main application
 # ---------------------------------------
 
+# Register RPC methods once at import rather than on every request
+dispatcher["echo"] = rpc_echo
+dispatcher["sleep"] = rpc_sleep
+dispatcher["check_health"] = rpc_check_health
+dispatcher["email_web_snapshot"] = rpc_email_web_snapshot
+dispatcher["email_history_report"] = rpc_email_history_report
+dispatcher["email_text"] = rpc_email_text
+dispatcher["roomba_get_state"] = rpc_roomba_get_state
+dispatcher["roomba_send_cmd"] = rpc_roomba_send_cmd
+dispatcher["motion_send_cmd"] = rpc_motion_send_cmd
+dispatcher["reboot"] = rpc_reboot_sys
+dispatcher["shutdown"] = rpc_shutdown_sys
+dispatcher["hub_safe_shutdown"] = rpc_hub_safe_shutdown
+dispatcher["swa_checkin_schedule"] = rpc_swa_checkin_schedule
+dispatcher["swa_checkin_ls"] = rpc_swa_checkin_ls
+dispatcher["swa_checkin_killall"] = rpc_swa_checkin_killall
+dispatcher["email_network_report"] = rpc_email_network_report
+
 @Request.application
 def application(request):
-    dispatcher["echo"] = rpc_echo
-    dispatcher["sleep"] = rpc_sleep
-    dispatcher["check_health"] = rpc_check_health
-    dispatcher["email_web_snapshot"] = rpc_email_web_snapshot
-    dispatcher["email_history_report"] = rpc_email_history_report
-    dispatcher["email_text"] = rpc_email_text
-    dispatcher["roomba_get_state"] = rpc_roomba_get_state
-    dispatcher["roomba_send_cmd"] = rpc_roomba_send_cmd
-    dispatcher["motion_send_cmd"] = rpc_motion_send_cmd
-    dispatcher["reboot"] = rpc_reboot_sys
-    dispatcher["shutdown"] = rpc_shutdown_sys
-    dispatcher["hub_safe_shutdown"] = rpc_hub_safe_shutdown
-    dispatcher["swa_checkin_schedule"] = rpc_swa_checkin_schedule
-    dispatcher["swa_checkin_ls"] = rpc_swa_checkin_ls
-    dispatcher["swa_checkin_killall"] = rpc_swa_checkin_killall
-    dispatcher["email_network_report"] = rpc_email_network_report
-
     response = JSONRPCResponseManager.handle(
         request.data, dispatcher)
     return Response(response.json, mimetype='application/json')
 
 def main():
     parser = argparse.ArgumentParser(description='Hubitat Offload Daemon')
-    parser.add_argument('--rpc-addr', type=str, default=get_host_ip_addr(), help='IP address to bing server to')
+    parser.add_argument('--rpc-addr', type=str, default=None, help='IP address to bing server to (default: host IP)')
     parser.add_argument('--rpc-port', type=int, default=RPC_PORT, help='TCP port to listen on')
     parser.add_argument('--processes', type=int, default=3, help='Max number of processes')
     parser.add_argument('--verbose', action='store_true', help='Verbose output')
     args = parser.parse_args()
 
     log_level = logging.DEBUG if args.verbose else logging.INFO
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     logging.basicConfig(level=log_level)
 
-    serve(application, host=args.rpc_addr, port=args.rpc_port, threads=args.processes)
+    # Resolve the default address only when needed. It can block waiting for the network.
+    rpc_addr = args.rpc_addr if args.rpc_addr else get_host_ip_addr()
+    serve(application, host=rpc_addr, port=args.rpc_port, threads=args.processes)
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
-import copy
-from datetime import datetime, timedelta
+from datetime import datetime
 import argparse
 import ipaddress
 import threading
@@ -16,18 +15,27 @@ from dominate.tags import *
 from common import MacAddrDb
 from common import EmailUtils
 
+ARP_LINE_RE = re.compile(r'(.+)\s+\((.+)\)\s+at.*')
+
 class RouterIfc:
+    TBL_SEP = '--- ip neigh ---'
+
     def __init__(self, ssh_addr, ssh_port, ssh_user, mac_tbl_dir):
-        self.arp_cmd = f'ssh {ssh_user}@{ssh_addr} -p {ssh_port} arp -a'
-        self.ip_neigh_cmd = f'ssh {ssh_user}@{ssh_addr} -p {ssh_port} ip neigh'
-        subprocess.check_output(self.ip_neigh_cmd, shell=True)
+        # Read the ARP and neighbor tables in a single SSH session
+        self.tbls_cmd = (f'ssh {ssh_user}@{ssh_addr} -p {ssh_port} '
+                         f'"arp -a && echo {RouterIfc.TBL_SEP} && ip neigh"')
+        subprocess.check_output(self.tbls_cmd, shell=True)
         self.mac_db = MacAddrDb(mac_tbl_dir)
 
-    def _read_ip_neigh(self, max_retries = 3):
+    def _read_tbls(self, max_retries = 3):
         neigh_cache = {}
+        arp_out = ''
+        tbls_read, last_error = False, None
         for i in range(max_retries):
             try:
-                ip_neigh_out = subprocess.check_output(self.ip_neigh_cmd, shell=True).decode('utf-8')
+                tbls_out = subprocess.check_output(self.tbls_cmd, shell=True).decode('utf-8')
+                tbls_read = True
+                arp_out, _, ip_neigh_out = tbls_out.partition(RouterIfc.TBL_SEP)
                 for line in ip_neigh_out.split('\n'):
                     toks = [x.strip() for x in line.split()]
                     if len(toks) > 0:
@@ -38,32 +46,36 @@ class RouterIfc:
                             ip, mac = None, None
                         neigh_cache[ip] = (mac, state)
                 failed_cnt = len([st for _, (_, st) in neigh_cache.items() if st in ['FAILED', 'INCOMPLETE']])
-            except Exception:
+            except Exception as e:
+                last_error = e
                 failed_cnt = 1000
 
             if failed_cnt == 0:
                 break
             if i == max_retries - 1:
                 time.sleep(0.25)
-        retval = []
+        # Only retry through FAILED/INCOMPLETE neighbor states. If the router could not
+        # be read at all then fail instead of reporting an empty client list.
+        if not tbls_read:
+            raise last_error
+        neigh = []
         for ip, (mac, state) in neigh_cache.items():
             if state not in ['FAILED', 'INCOMPLETE']:
-                retval.append((ip, mac, self.mac_db.get_vendor(mac, 'Unknown')))
-        return sorted(retval, key = lambda x: ipaddress.IPv4Address(x[0]))
+                neigh.append((ip, mac, self.mac_db.get_vendor(mac, 'Unknown')))
+        return self._parse_arp_tbl(arp_out), sorted(neigh, key = lambda x: ipaddress.IPv4Address(x[0]))
 
-    def _read_arp_tbl(self):
-        arp_out = subprocess.check_output(self.arp_cmd, shell=True).decode('utf-8')
+    def _parse_arp_tbl(self, arp_out):
         arp_tbl = {}
         for line in arp_out.split('\n'):
-            m = re.match(r'(.+)\s+\((.+)\)\s+at.*', line)
+            m = ARP_LINE_RE.match(line)
             if m is not None:
                 arp_tbl[m.group(2)] = m.group(1)
         return arp_tbl
 
     def get_active_clients(self):
-        arp_tbl = self._read_arp_tbl()
+        arp_tbl, neigh = self._read_tbls()
         all_clients = []
-        for ip, mac, vendor in self._read_ip_neigh():
+        for ip, mac, vendor in neigh:
             if ip in arp_tbl:
                 client_name = arp_tbl[ip].lower()
                 if client_name == '?':
@@ -82,14 +94,19 @@ class LanMonitor:
                  known_mac_addrs = [], notification_email_addr = None, pickle_dump_fname = None):
         self.rtr_ifc = RouterIfc(rtr_ssh_addr, rtr_ssh_port, rtr_ssh_user, mac_tbl_dir)
         self.interval = poll_interval
-        self.known_mac_addrs = set([x.split()[0].lower() for x in known_mac_addrs])
-        self.mac_aliases = {x.split()[0].lower(): ' '.join(x.split()[1:]) for x in known_mac_addrs}
+        self.known_mac_addrs = set()
+        self.mac_aliases = {}
+        for known_mac in known_mac_addrs:
+            toks = known_mac.split()
+            self.known_mac_addrs.add(toks[0].lower())
+            self.mac_aliases[toks[0].lower()] = ' '.join(toks[1:])
         self.notification_email_addr = notification_email_addr
         self.pickle_dump_fname = pickle_dump_fname
         self.curr_clients = self.rtr_ifc.get_active_clients()
-        self.last_clients = copy.deepcopy(self.curr_clients)
+        self.active_ips = set([t[0] for t in self.curr_clients])
+        self.last_macs = set([t[1] for t in self.curr_clients]) - self.known_mac_addrs
         self.quiesce_tbl = {}
-        self.stop_thread = False
+        self.stop_event = threading.Event()
         self.monitor_error = None
         self.lock = threading.Lock()
         self.mon_thread = threading.Thread(target=self._monitor_loop)
@@ -97,15 +114,20 @@ class LanMonitor:
 
     def _monitor_loop(self):
         try:
-            while not self.stop_thread:
-                next_t = datetime.today() + timedelta(seconds=self.interval)
+            while not self.stop_event.is_set():
+                next_t = time.monotonic() + self.interval
+                # Query the router without holding the lock so readers are never
+                # blocked on ssh, then publish the new snapshot in one step
+                curr_clients = []
+                for ip, mac, vendor, name in self.rtr_ifc.get_active_clients():
+                    known_alias = self.mac_aliases.get(mac, '')
+                    if name == 'Unknown' and known_alias:
+                        name = f'Known ({known_alias})'
+                    curr_clients.append((ip, mac, vendor, name))
+                active_ips = set([t[0] for t in curr_clients])
                 with self.lock:
-                    self.curr_clients = []
-                    for ip, mac, vendor, name in self.rtr_ifc.get_active_clients():
-                        known_alias = self.mac_aliases[mac] if mac in self.mac_aliases else ''
-                        if name == 'Unknown' and known_alias:
-                            name = f'Known ({known_alias})'
-                        self.curr_clients.append((ip, mac, vendor, name))
+                    self.curr_clients = curr_clients
+                    self.active_ips = active_ips
                 self._handle_new_client_notifications()
                 if self.pickle_dump_fname:
                     with open(self.pickle_dump_fname, 'wb') as pickle_f:
@@ -116,44 +138,36 @@ class LanMonitor:
                         fcntl.flock(pickle_f.fileno(), fcntl.LOCK_EX)
                         pickle.dump(pickle_ds, pickle_f, protocol=pickle.HIGHEST_PROTOCOL)
                         fcntl.flock(pickle_f.fileno(), fcntl.LOCK_UN)
-                sleep_sec = (next_t - datetime.today()).total_seconds()
+                sleep_sec = next_t - time.monotonic()
                 if sleep_sec > 0.0:
-                    time.sleep(sleep_sec)
+                    self.stop_event.wait(sleep_sec)
         except Exception:
             with self.lock:
                 self.monitor_error = traceback.format_exc()
 
     def _handle_new_client_notifications(self):
-        last_macs = set([t[1] for t in self.last_clients]) - self.known_mac_addrs
+        last_macs = self.last_macs
         curr_macs = set([t[1] for t in self.curr_clients]) - self.known_mac_addrs
+        now = time.monotonic()
         if last_macs != curr_macs:
             new_client_idxs = []
+            quiesce_until = now + LanMonitor.QUIESCE_HOURS * 3600
             for idx, (ip, mac, vendor, client_name) in enumerate(self.curr_clients):
                 if mac in curr_macs and mac not in last_macs and mac not in self.quiesce_tbl:
                     new_client_idxs.append(idx)
-                    self.quiesce_tbl[mac] = datetime.today() + timedelta(hours=LanMonitor.QUIESCE_HOURS)
+                    self.quiesce_tbl[mac] = quiesce_until
             new_clients = [self.curr_clients[i] for i in new_client_idxs]
             if new_clients and self.notification_email_addr:
                 self._send_notification(new_clients)
-        for qmac in list(self.quiesce_tbl.keys()):
-            if self.quiesce_tbl[qmac] < datetime.today():
-                del self.quiesce_tbl[qmac]
-        self.last_clients = copy.deepcopy(self.curr_clients)
+        for qmac in [m for m, t in self.quiesce_tbl.items() if t < now]:
+            del self.quiesce_tbl[qmac]
+        self.last_macs = curr_macs
 
     def _send_notification(self, new_clients):
         title = 'LAN Monitor Notification'
         doc = dominate.document(title=title, doctype=None)
         with doc:
-            style("""\
-                    table, th, td {
-                        border: 1px solid;
-                        border-collapse: collapse;
-                    }
-                    th, td {
-                        padding-top: 3px; padding-bottom: 3px;
-                        padding-left: 5px; padding-right: 5px;
-                    }
-                  """)
+            style(EmailUtils.TABLE_CSS)
             h2(title)
             p(f'{datetime.now().strftime("%Y-%m-%d %l:%M:%S %p")}', style="font-weight: bold; color:blue")
             p(f'One or more new devices have connected to the Home LAN')
@@ -173,11 +187,17 @@ class LanMonitor:
         EmailUtils.send_email_html(self.notification_email_addr, subject, str(doc))
 
     def stop(self):
-        self.stop_thread = True
+        self.stop_event.set()
         self.mon_thread.join()
 
     def get_active_clients(self):
         with self.lock:
             if self.monitor_error:
                 raise RuntimeError(f'LanMonitor error: {self.monitor_error}')
-            return copy.deepcopy(self.curr_clients)
+            return list(self.curr_clients)
+
+    def is_client_active(self, ip_addr):
+        with self.lock:
+            if self.monitor_error:
+                raise RuntimeError(f'LanMonitor error: {self.monitor_error}')
+            return ip_addr in self.active_ips
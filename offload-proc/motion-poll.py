@@ -8,6 +8,8 @@ import re
 import glob
 from common import EmailUtils
 
+SUMMARY_JPG_RE = re.compile('(.+)-(.+)-e(.+)-f(.+).jpg')
+
 def discover_new_files(base_dir):
     pickle_fname = os.path.join(base_dir, 'snapshot.pickle')
     prev_st = set()
@@ -19,8 +21,9 @@ def discover_new_files(base_dir):
         fpath = os.path.join(base_dir, fpath)
         if os.path.isfile(fpath) and fpath != pickle_fname:
             curr_st.add(fpath)
-    with open(pickle_fname, 'wb') as pickle_f:
-        pickle.dump(curr_st, pickle_f)
+    if curr_st != prev_st:
+        with open(pickle_fname, 'wb') as pickle_f:
+            pickle.dump(curr_st, pickle_f)
     if prev_st is not None:
         return list(curr_st - prev_st)
     else:
@@ -33,7 +36,7 @@ def poll(base_dir, cam_name, email_addr, verbose):
     for jpeg_f in discover_new_files(base_dir):
         if verbose:
             print(f'[DEBUG] Found new file: {jpeg_f}')
-        match = re.match('(.+)-(.+)-e(.+)-f(.+).jpg', os.path.basename(jpeg_f))
+        match = SUMMARY_JPG_RE.match(os.path.basename(jpeg_f))
         if match:
             if verbose:
                 print(f'[DEBUG] Found new summary image: {jpeg_f}')
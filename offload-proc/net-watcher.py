@@ -7,6 +7,8 @@ import netifaces
 import re
 from nmap import PortScanner
 
+OUI_LINE_RE = re.compile(r'([0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2})\s+\(hex\)\s+(.+)')
+
 class NetIfcInfo:
     def __init__(self):
         # Pick a gateway
@@ -35,9 +37,7 @@ class IeeeOuiTbl:
         self.oui_tbl = {}
         for line in url_resp.text.split('\n'):
             try:
-                mac, company = re.search(
-                    r'([0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2})\s+\(hex\)\s+(.+)',
-                line).groups()
+                mac, company = OUI_LINE_RE.search(line).groups()
                 self.oui_tbl[mac.replace('-', ':')] = company
             except AttributeError:
                 continue
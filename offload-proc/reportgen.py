@@ -7,6 +7,7 @@ import argparse
 import tempfile
 from datetime import datetime
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import dominate
 from dominate.tags import *
@@ -32,15 +33,33 @@ class HistoryReportGen:
         return f'http://{addr}/d/{ids[dashboard]}?orgId=1&from={ms_strt}&to={ms_stop}&kiosk'
 
     def send_email(self, t_strt, t_stop, email_addr):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Browser startup is slow and independent of the DB queries so overlap the two
+            logging.info('HistoryReportGen: Starting browser...')
+            webshot_fut = executor.submit(WebScreenshotFirefox)
+            try:
+                tables = self._pull_tables(t_strt, t_stop)
+            except Exception:
+                # Nothing to render so shut the browser down instead of leaving it to __del__
+                if webshot_fut.exception() is None:
+                    webshot = webshot_fut.result()
+                    webshot.driver.quit()
+                    webshot.driver = None
+                raise
+            webshot = webshot_fut.result()
+        self._render_and_send(webshot, tables, t_strt, t_stop, email_addr)
+
+    def _pull_tables(self, t_strt, t_stop):
         logging.info('HistoryReportGen: Pulling data from influxdb...')
         event_log = []
         door_tbl = [('Door', 'Opens')]
         for d in self.senscfg['doors']:
             meas, dev = meas_dev(d['status'])
             sens = SensorHist(self.dbcli, meas, dev, t_strt, t_stop)
-            opens = len([ts for ts, val in sens.calc_transitions() if val < 0])
+            transitions = sens.calc_transitions()
+            opens = len([ts for ts, val in transitions if val < 0])
             door_tbl.append((d['name'], str(opens)))
-            for ts, val in sens.calc_transitions():
+            for ts, val in transitions:
                 event_log.append((ts, f'{d["name"]} {("OPENED" if val < 0 else "CLOSED")}'))
         motion_tbl = [('Zone', 'Activity Factor')]
         for d in self.senscfg['motion-zones']:
@@ -69,9 +88,10 @@ class HistoryReportGen:
                 vals.append(val)
             camera_tbl.append((d['name'], *tuple(vals)))
         event_log.sort()
+        return door_tbl, motion_tbl, camera_tbl, event_log
 
-        logging.info('HistoryReportGen: Starting browser...')
-        webshot = WebScreenshotFirefox()
+    def _render_and_send(self, webshot, tables, t_strt, t_stop, email_addr):
+        door_tbl, motion_tbl, camera_tbl, event_log = tables
         logging.info('HistoryReportGen: Taking grafana screenshots...')
         imgs = {
             'timeline_dashboard': tempfile.mktemp(suffix='.png'),
@@ -86,16 +106,7 @@ class HistoryReportGen:
         title = 'Sensor History Report'
         doc = dominate.document(title=title, doctype=None)
         with doc:
-            style("""\
-                    table, th, td {
-                        border: 1px solid;
-                        border-collapse: collapse;
-                    }
-                    th, td {
-                        padding-top: 3px; padding-bottom: 3px;
-                        padding-left: 5px; padding-right: 5px;
-                    }
-                  """)
+            style(EmailUtils.TABLE_CSS)
             h2(title)
             p(f'{t_strt.strftime("%Y-%m-%d %l:%M:%S %p")} - {t_stop.strftime("%Y-%m-%d %l:%M:%S %p")}',
               style="font-weight: bold; color:blue")
@@ -146,16 +157,7 @@ class NetworkReportGen:
         title = 'Network Report'
         doc = dominate.document(title=title, doctype=None)
         with doc:
-            style("""\
-                    table, th, td {
-                        border: 1px solid;
-                        border-collapse: collapse;
-                    }
-                    th, td {
-                        padding-top: 3px; padding-bottom: 3px;
-                        padding-left: 5px; padding-right: 5px;
-                    }
-                  """)
+            style(EmailUtils.TABLE_CSS)
             h2(title)
             p(f'{report_time.strftime("%Y-%m-%d %l:%M:%S %p")}',
               style="font-weight: bold; color:blue")
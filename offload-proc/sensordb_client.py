@@ -14,6 +14,7 @@ DB_NAME = 'Hubitat'
 IGNORE_COLS = ['hubId', 'hubName', 'locationId', 'locationName', 'groupId', 'groupName']
 TIME_ATTR = 'time'
 DEVICE_ATTR = 'deviceName'
+WILDCARD_DEV_PATTERNS = ['.*', '^.*$', '.*$', '^.*']
 
 def utc2local(utc):
     epoch = time.mktime(utc.timetuple())
@@ -78,14 +79,19 @@ class SensorDbClient:
         sql = (f'SELECT * FROM "{measurement}" '
                f'WHERE ({TIME_ATTR} >= {t_strt_unix} AND {TIME_ATTR} <= {t_stop_unix}) '
                f'ORDER BY {TIME_ATTR} {("DESC" if reverse else "ASC")}')
+        if not device_regex:
+            dev_match = lambda name: name == device
+        elif device in WILDCARD_DEV_PATTERNS:
+            dev_match = lambda name: True
+        elif re.escape(device) == device:
+            # Literal pattern: a substring test is equivalent to re.search
+            dev_match = lambda name: device in name
+        else:
+            dev_match = re.compile(device).search
         results = []
         for rrow in self.query_raw_sql(sql):
             frow = {}
-            if device_regex:
-                dev_match = (re.search(device, rrow[DEVICE_ATTR]) is not None)
-            else:
-                dev_match = (device == rrow[DEVICE_ATTR])
-            if dev_match:
+            if dev_match(rrow[DEVICE_ATTR]):
                 for key in rrow:
                     if key in IGNORE_COLS:
                         continue